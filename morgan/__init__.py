@@ -1,16 +1,23 @@
 import argparse
+import concurrent.futures
 import configparser
+import functools
+import gzip
 import hashlib
 import json
 import os
 import os.path
 import re
+import sqlite3
+import sys
 import tarfile
+import tempfile
+import threading
 import traceback
+import urllib.error
 import urllib.parse
-import urllib.request
 import zipfile
-from typing import Dict, Iterable, Tuple
+from typing import BinaryIO, Dict, FrozenSet, Iterable, Iterator, Tuple
 
 import packaging.requirements
 import packaging.specifiers
@@ -18,11 +25,32 @@ import packaging.tags
 import packaging.utils
 import packaging.version
 
-from morgan import configurator, metadata, server
+from morgan import configurator, connections, metadata, server
 from morgan.__about__ import __version__
 
 PYPI_ADDRESS = "https://pypi.org/simple/"
 PREFERRED_HASH_ALG = "sha256"
+CHUNK_SIZE = 1 << 20
+MANIFEST_BATCH_SIZE = 500
+
+# response headers that are stored along with cached Simple API responses,
+# mapped to the request headers used to revalidate them
+CACHE_VALIDATORS = {
+    'ETag': 'If-None-Match',
+    'Last-Modified': 'If-Modified-Since',
+}
+
+# environment markers that cannot be reliably defined for client environments,
+# and are therefore always empty
+EMPTY_ENV_MARKERS = {
+    'platform_release': '',
+    'platform_version': '',
+    'implementation_version': '',
+    'extra': '',
+}
+
+env_key_re = re.compile(r"env\.(.+)")
+interpreter_re = re.compile(r"([^\d]+)(?:(\d)(?:[._])?(\d+)?)")
 
 
 class Mirrorer:
@@ -33,9 +61,11 @@ class Mirrorer:
     them again as dependencies.
     """
 
-    def __init__(self, index_path: str):
+    def __init__(self, index_path: str, download_workers: int = 8):
         """
-        The constructor only needs to path to the package index.
+        The constructor only needs to path to the package index. The number of
+        files downloaded, and of packages mirrored, concurrently can optionally
+        be provided.
         """
 
         # load the configuration from the index_path, and parse the environments
@@ -46,31 +76,71 @@ class Mirrorer:
         self.envs = {}
         self._supported_pyversions = []
         self._supported_platforms = []
+        # several environments usually share a Python version or a platform,
+        # keep each of them once so matching doesn't repeat identical checks
+        seen_pyversions = set()
+        seen_platforms = set()
         for key in self.config:
-            m = re.fullmatch(r"env\.(.+)", key)
+            m = env_key_re.fullmatch(key)
             if m:
-                env = self.config[key]
-                env['platform_release'] = ''
-                env['platform_version'] = ''
-                env['implementation_version'] = ''
-                env['extra'] = ''
-                self.envs[m.group(1)] = dict(env)
-                self._supported_pyversions.append(env["python_version"])
-                self._supported_platforms.append(
-                    re.compile(r".*" +
-                               env["sys_platform"] +
-                               r".*" +
-                               env["platform_machine"]))
+                env = {**self.config[key], **EMPTY_ENV_MARKERS}
+                self.envs[m.group(1)] = env
+                if env["python_version"] not in seen_pyversions:
+                    seen_pyversions.add(env["python_version"])
+                    self._supported_pyversions.append(env["python_version"])
+                platform = (r".*" +
+                            env["sys_platform"] +
+                            r".*" +
+                            env["platform_machine"])
+                if platform not in seen_platforms:
+                    seen_platforms.add(platform)
+                    self._supported_platforms.append(re.compile(platform))
 
         self._processed_pkgs = {}
+        self._projects = {}
+        self._http = connections.ConnectionPool()
+        self._cache_dir = os.path.join(self.index_path, ".morgan-cache")
+
+        # the manifest records the size, modification time and hash of every
+        # verified file, so that files that didn't change since don't need to
+        # be hashed again on later runs. it is a SQLite database, opened on
+        # first use, so that recording a file doesn't rewrite all the others
+        self._manifest_path = os.path.join(self._cache_dir, "manifest.sqlite")
+        self._manifest = None
+        self._manifest_pending = 0
+        self._manifest_lock = threading.Lock()
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=download_workers)
+        self._level_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=download_workers)
+
+        # the environments are fixed for the whole run, so whether a
+        # requires-python specifier, a wheel tag or a dependency's environment
+        # marker is supported only needs to be computed once per distinct value
+        self._pyreq_support = {}
+        self._interpreter_support = {}
+        self._platform_support = {}
+        self._tags_support = {}
+        self._marker_relevance = {}
 
     def mirror(self, requirement_string: str):
         """
         Mirror a package according to a PEP 508-compliant requirement string.
         """
 
-        requirement = parse_requirement(requirement_string)
+        # files verified so far are committed to the manifest even if
+        # mirroring fails (or is interrupted) midway. all tasks are done by
+        # then, as every batch of them is waited for in full
+        try:
+            self._mirror_requirement(parse_requirement(requirement_string))
+        finally:
+            self._commit_manifest()
 
+    def _mirror_requirement(
+        self,
+        requirement: packaging.requirements.Requirement,
+    ):
         try:
             deps = self._mirror(requirement)
         except urllib.error.HTTPError as err:
@@ -83,15 +153,94 @@ class Mirrorer:
             return
 
         while len(deps) > 0:
+            # all packages of the same level are mirrored concurrently, but
+            # requirements for the same package are mirrored one after the
+            # other by the same task, as they may resolve to the same files
+            groups = {}
+            for dep in deps.values():
+                groups.setdefault(dep["requirement"].name, []).append(dep)
+            futures = [
+                self._level_pool.submit(self._mirror_group, group)
+                for group in groups.values()
+            ]
+            # wait for the whole level before surfacing any error, so that no
+            # task is still writing to the index (or to the manifest) once
+            # this method returns or raises
+            wait_all(futures)
+            results = [
+                more_deps
+                for future in futures
+                for more_deps in future.result()
+                if more_deps
+            ]
+
+            # the same dependency is often required by several packages of the
+            # same level, so only enqueue requirements that weren't processed
+            # yet, and collapse equivalent ones
             next_deps = {}
-            for dep in deps:
-                more_deps = self._mirror(
-                    deps[dep]["requirement"],
-                    required_by=deps[dep]["required_by"],
-                )
-                if more_deps:
-                    next_deps.update(more_deps)
-            deps = next_deps.copy()
+            for more_deps in results:
+                for more_dep in more_deps.values():
+                    req = more_dep["requirement"]
+                    if str(req) in self._processed_pkgs:
+                        continue
+                    key = (req.name, str(req.specifier), frozenset(req.extras))
+                    if key not in next_deps:
+                        next_deps[key] = more_dep
+            deps = next_deps
+
+    def prefetch(self, names: Iterable[str]):
+        """
+        Fetch information about the provided packages from the Simple API
+        concurrently, ahead of mirroring them, so that mirroring doesn't wait
+        on each of them in turn. Errors are ignored, they are reported when the
+        packages are actually mirrored.
+        """
+
+        futures = [
+            self._level_pool.submit(self._fetch_project, name)
+            for name in {packaging.utils.canonicalize_name(name)
+                         for name in names}
+        ]
+        wait_all(futures)
+
+    def save_manifest(self):
+        """
+        Save pending changes to the manifest of verified files, and close it.
+        Changes are also saved at the end of every call to the mirror method.
+        This is called automatically when the mirrorer is closed.
+        """
+
+        with self._manifest_lock:
+            if self._manifest is None:
+                return
+            self._manifest.commit()
+            self._manifest.close()
+            self._manifest = None
+            self._manifest_pending = 0
+
+    def close(self):
+        """
+        Save the manifest of verified files, and shut down the threads used
+        for mirroring. The mirrorer cannot be used after it was closed. This
+        is called automatically at the end of the mirror function.
+        """
+
+        self._level_pool.shutdown(wait=True)
+        self._pool.shutdown(wait=True)
+        self.save_manifest()
+
+    def _commit_manifest(self):
+        with self._manifest_lock:
+            if self._manifest is None:
+                return
+            self._manifest.commit()
+            self._manifest_pending = 0
+
+    def _mirror_group(self, deps: Iterable[dict]) -> Iterable[dict]:
+        return [
+            self._mirror(dep["requirement"], required_by=dep["required_by"])
+            for dep in deps
+        ]
 
     def copy_server(self):
         """
@@ -122,23 +271,11 @@ class Mirrorer:
             return None
 
         if required_by:
-            print("[{}]: {}".format(required_by, requirement))
+            log("[{}]: {}".format(required_by, requirement))
         else:
-            print("{}".format(requirement))
-
-        data: dict = None
-
-        # get information about this package from the Simple API in JSON
-        # format as per PEP 691
-        request = urllib.request.Request(
-            "{}{}/".format(PYPI_ADDRESS, requirement.name),
-            headers={
-                'Accept': 'application/vnd.pypi.simple.v1+json',
-            },
-        )
+            log("{}".format(requirement))
 
-        with urllib.request.urlopen(request) as response:
-            data = json.load(response)
+        data = self._fetch_project(requirement.name)
 
         # check metadata version ~1.0
         v_str = data["meta"]["api-version"]
@@ -167,90 +304,152 @@ class Mirrorer:
         if len(files) == 0:
             raise Exception(f"No files match requirement {requirement}")
 
-        # download all files
-        depdict = {}
-        for file in files:
-            try:
-                file_deps = self._process_file(requirement, file)
-                if file_deps:
-                    depdict.update(file_deps)
-            except Exception:
-                print("\tFailed processing file {}, skipping it".format(
-                    file["filename"]))
-                traceback.print_exc()
-                continue
+        depdict = self._process_files(requirement, files)
 
         self._processed_pkgs[req_str] = True
 
         return depdict
 
+    def _fetch_project(self, name: str) -> dict:
+        # responses are kept in memory for the rest of the run, and on disk
+        # along with their validators (ETag and Last-Modified), so that later
+        # runs can make conditional requests and reuse the stored response if
+        # nothing changed
+        data = self._projects.get(name)
+        if data is not None:
+            return data
+
+        # bodies are stored gzipped (as they are usually served), project
+        # pages of large packages weigh megabytes of highly repetitive JSON
+        cache_path = os.path.join(self._cache_dir, "{}.json.gz".format(name))
+        validators_path = os.path.join(
+            self._cache_dir, "{}.headers".format(name))
+
+        # get information about this package from the Simple API in JSON
+        # format as per PEP 691
+        headers = {
+            'Accept': 'application/vnd.pypi.simple.v1+json',
+            'Accept-Encoding': 'gzip',
+        }
+        conditional = \
+            os.path.exists(cache_path) and os.path.exists(validators_path)
+        if conditional:
+            with open(validators_path, "r") as fh:
+                for (header, value) in json.load(fh).items():
+                    headers[CACHE_VALIDATORS[header]] = value
+
+        try:
+            with self._http.open(
+                    "{}{}/".format(PYPI_ADDRESS, name), headers) as response:
+                body = response.read()
+                if response.headers.get("Content-Encoding") != "gzip":
+                    body = gzip.compress(body)
+                validators = {
+                    header: response.headers[header]
+                    for header in CACHE_VALIDATORS
+                    if response.headers.get(header)
+                }
+        except urllib.error.HTTPError as err:
+            if err.code != 304 or not conditional:
+                raise
+            try:
+                with open(cache_path, "rb") as fh:
+                    data = json.loads(gzip.decompress(fh.read()))
+            except Exception as e:
+                # the stored response is damaged (e.g. by an interrupted
+                # run), forget its validators and fetch it again in full
+                log(f"\tDiscarding cached response for {name}: {e}")
+                os.remove(validators_path)
+                return self._fetch_project(name)
+        else:
+            data = json.loads(gzip.decompress(body))
+
+            # the validators are removed before the body is replaced, and
+            # both are replaced atomically, so an interrupted run can't leave
+            # validators that don't match the stored body
+            os.makedirs(self._cache_dir, exist_ok=True)
+            if os.path.exists(validators_path):
+                os.remove(validators_path)
+            write_atomically(cache_path, body)
+            if validators:
+                write_atomically(
+                    validators_path, json.dumps(validators).encode("UTF-8"))
+
+        self._projects[name] = data
+        return data
+
     def _filter_files(
         self,
         requirement: packaging.requirements.Requirement,
         files: Iterable[dict],
     ) -> Iterable[dict]:
-        # remove files with unsupported extensions
-        files = list(filter(lambda file: re.search(
-            r"\.(whl|zip|tar.gz)$", file["filename"]), files))
-
-        # parse versions and platform tags for each file
+        # parse versions and platform tags in a single pass, keeping only files
+        # that are not yanked, and have supported extensions and valid versions
+        parsed_files = []
         for file in files:
+            # yanked files are ignored, no need to parse them
+            if file.get("yanked", False):
+                continue
+
+            filename = file["filename"]
             try:
-                if re.search(r"\.whl$", file["filename"]):
+                if filename.endswith(".whl"):
                     _, file["version"], ___, file["tags"] = \
-                        packaging.utils.parse_wheel_filename(
-                            file["filename"])
+                        parse_wheel_filename(filename)
                     file["is_wheel"] = True
-                elif re.search(r"\.(tar\.gz|zip)$", file["filename"]):
-                    _, file["version"] = packaging.utils.parse_sdist_filename(
-                        file["filename"])
+                elif filename.endswith((".tar.gz", ".zip")):
+                    _, file["version"] = parse_sdist_filename(filename)
                     file["is_wheel"] = False
                     file["tags"] = None
+                else:
+                    # unsupported extension
+                    continue
             except packaging.version.InvalidVersion:
                 # ignore files with invalid version, PyPI no longer allows
                 # packages with special versioning schemes, and we assume we
                 # can ignore such files
                 continue
             except Exception:
-                print("\tSkipping file {}, exception caught".format(
-                    file["filename"]))
+                log("\tSkipping file {}, exception caught".format(filename))
                 traceback.print_exc()
                 continue
 
-        # sort all files by version in reverse order, and ignore yanked files
-        files = list(filter(lambda file: "version" in file and
-                            not file.get("yanked", False), files))
-        files.sort(key=lambda file: file["version"], reverse=True)
+            parsed_files.append(file)
+
+        # sort all files by version in reverse order. the versions' comparison
+        # keys are compared directly, sparing a call to Version.__lt__ for
+        # every comparison
+        files = parsed_files
+        files.sort(key=lambda file: file["version"]._key, reverse=True)
 
         # keep only files of the latest version that satisfies the
         # requirement (if requirement doesn't have any version specifiers,
         # take latest available version)
         if requirement.specifier is not None:
-            files = list(filter(
-                lambda file: requirement.specifier.contains(
-                    file["version"]),
-                files))
+            files = [file for file in files
+                     if requirement.specifier.contains(file["version"])]
 
         if len(files) == 0:
-            print(f"Skipping {requirement}, no version matches requirement")
+            log(f"Skipping {requirement}, no version matches requirement")
             return None
 
         # Now we only have files that satisfy the requirement, and we need to
-        # filter out files that do not match our environments.
-        files = list(filter(
-            lambda file: self._matches_environments(file), files))
+        # filter out files that do not match our environments. Only files from
+        # the latest version that satisifies all specifiers and environments
+        # are kept, and since files are sorted by version, files of older
+        # versions don't need to be checked once a match was found.
+        latest_files = []
+        for file in files:
+            if latest_files and file["version"] != latest_files[0]["version"]:
+                break
+            if self._matches_environments(file):
+                latest_files.append(file)
 
-        if len(files) == 0:
-            print(f"Skipping {requirement}, no file matches environments")
+        if len(latest_files) == 0:
+            log(f"Skipping {requirement}, no file matches environments")
             return None
 
-        # Only keep files from the latest version that satisifies all
-        # specifiers and environments
-        latest_version = files[0]["version"]
-        files = list(filter(
-            lambda file: file["version"] == latest_version, files))
-
-        return files
+        return latest_files
 
     def _matches_environments(self, fileinfo: dict) -> bool:
         if fileinfo.get("requires-python", None):
@@ -264,40 +463,88 @@ class Mirrorer:
                 fileinfo["requires-python"] = "=={}".format(
                     fileinfo["requires-python"])
             try:
-                spec_set = packaging.specifiers.SpecifierSet(
-                    fileinfo["requires-python"])
-                for supported_python in self._supported_pyversions:
-                    if not spec_set.contains(supported_python):
-                        # file does not support the Python version of one of our
-                        # environments, reject it
-                        return False
+                if not self._supports_pyversions(fileinfo["requires-python"]):
+                    # file does not support the Python version of one of our
+                    # environments, reject it
+                    return False
             except Exception as e:
-                print(f"Ignoring {fileinfo['filename']}: {e}")
+                log(f"Ignoring {fileinfo['filename']}: {e}")
                 return False
 
         if fileinfo.get("tags", None):
             # At least one of the tags must match ALL of our environments
-            for tag in fileinfo["tags"]:
-                (intrp_name, intrp_ver) = parse_interpreter(tag.interpreter)
-                if intrp_name not in ("py", "cp"):
-                    continue
-                if (intrp_ver and
-                        intrp_ver != "3" and
-                        intrp_ver not in self._supported_pyversions):
-                    continue
+            return self._supports_tags(fileinfo["tags"])
 
-                if tag.platform == "any":
-                    return True
-                else:
-                    for platformre in self._supported_platforms:
-                        if platformre.fullmatch(tag.platform):
-                            # tag matched, accept this file
-                            return True
+        return True
 
-            # none of the tags matched, reject this file
-            return False
+    def _supports_tags(self, tags: FrozenSet[packaging.tags.Tag]) -> bool:
+        # most wheels share their set of tags with the wheels of other
+        # versions (e.g. py3-none-any), so each set is only evaluated once
+        supported = self._tags_support.get(tags)
+        if supported is None:
+            supported = any(
+                self._supports_interpreter(tag.interpreter) and
+                self._supports_platform(tag.platform)
+                for tag in tags)
+            self._tags_support[tags] = supported
+        return supported
+
+    def _supports_pyversions(self, spec_string: str) -> bool:
+        supported = self._pyreq_support.get(spec_string)
+        if supported is None:
+            spec_set = packaging.specifiers.SpecifierSet(spec_string)
+            supported = all(spec_set.contains(supported_python)
+                            for supported_python in self._supported_pyversions)
+            self._pyreq_support[spec_string] = supported
+        return supported
+
+    def _supports_interpreter(self, interpreter: str) -> bool:
+        supported = self._interpreter_support.get(interpreter)
+        if supported is None:
+            (intrp_name, intrp_ver) = parse_interpreter(interpreter)
+            supported = intrp_name in ("py", "cp") and (
+                not intrp_ver or
+                intrp_ver == "3" or
+                intrp_ver in self._supported_pyversions)
+            self._interpreter_support[interpreter] = supported
+        return supported
+
+    def _supports_platform(self, platform: str) -> bool:
+        supported = self._platform_support.get(platform)
+        if supported is None:
+            supported = platform == "any" or any(
+                platformre.fullmatch(platform)
+                for platformre in self._supported_platforms)
+            self._platform_support[platform] = supported
+        return supported
+
+    def _process_files(
+        self,
+        requirement: packaging.requirements.Requirement,
+        files: Iterable[dict],
+    ) -> Dict[str, dict]:
+        # download, verify and extract metadata from all files concurrently,
+        # they are independent of each other. results are collected in
+        # submission order to keep the resolved dependencies deterministic.
+        # files that fail processing are skipped
+        futures = [
+            (file, self._pool.submit(self._process_file, requirement, file))
+            for file in files
+        ]
+        wait_all(future for (_, future) in futures)
+        depdict = {}
+        for (file, future) in futures:
+            try:
+                file_deps = future.result()
+                if file_deps:
+                    depdict.update(file_deps)
+            except Exception:
+                log("\tFailed processing file {}, skipping it".format(
+                    file["filename"]))
+                traceback.print_exc()
+                continue
 
-        return True
+        return depdict
 
     def _process_file(
         self,
@@ -315,7 +562,8 @@ class Mirrorer:
         md = self._extract_metadata(
             filepath, requirement.name, fileinfo["version"])
 
-        deps = md.dependencies(requirement.extras, self.envs.values())
+        deps = md.dependencies(
+            requirement.extras, self.envs.values(), self._marker_relevance)
         if deps is None:
             return None
 
@@ -336,42 +584,118 @@ class Mirrorer:
     ) -> bool:
         exphash = fileinfo["hashes"][hashalg]
 
-        os.makedirs(os.path.dirname(target), exist_ok=True)
-
         # if target already exists, verify its hash and only download if
-        # there's a mismatch
-        if os.path.exists(target):
+        # there's a mismatch. the hash is only computed again if the file
+        # changed since it was last verified
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None:
+            if self._verified(target, st, hashalg, exphash):
+                return True
             truehash = self._hash_file(target, hashalg)
             if truehash == exphash:
+                self._record_verified(target, hashalg, truehash)
                 return True
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
 
-        print("\t{}...".format(fileinfo["url"]), end=" ")
-        with urllib.request.urlopen(fileinfo["url"]) as inp, \
+        # stream the response to disk, hashing it along the way, so the file
+        # doesn't need to be held in memory or read again
+        truehash = hashlib.new(hashalg)
+        with self._http.open(fileinfo["url"]) as inp, \
                 open(target, "wb") as out:
-            out.write(inp.read())
-        print("done")
+            for chunk in read_chunks(inp):
+                out.write(chunk)
+                truehash.update(chunk)
+        log("\t{}... done".format(fileinfo["url"]))
 
-        truehash = self._hash_file(target, hashalg)
-        if truehash != exphash:
+        if truehash.hexdigest() != exphash:
             raise Exception(
                 "Digest mismatch for {}".format(fileinfo["filename"]))
 
+        self._write_hash_file(target, hashalg, truehash.hexdigest())
+        self._record_verified(target, hashalg, truehash.hexdigest())
+
         return True
 
+    def _verified(
+        self,
+        filepath: str,
+        st: os.stat_result,
+        hashalg: str,
+        exphash: str,
+    ) -> bool:
+        with self._manifest_lock:
+            entry = self._open_manifest().execute(
+                "SELECT size, mtime_ns, hashalg, hash FROM files WHERE path=?",
+                (os.path.relpath(filepath, self.index_path),),
+            ).fetchone()
+        return entry == (st.st_size, st.st_mtime_ns, hashalg, exphash) and \
+            os.path.exists("{}.hash".format(filepath))
+
+    def _record_verified(self, filepath: str, hashalg: str, hexdigest: str):
+        st = os.stat(filepath)
+        with self._manifest_lock:
+            manifest = self._open_manifest()
+            manifest.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (os.path.relpath(filepath, self.index_path),
+                 st.st_size, st.st_mtime_ns, hashalg, hexdigest),
+            )
+            # commit in batches, rather than syncing every file
+            self._manifest_pending += 1
+            if self._manifest_pending >= MANIFEST_BATCH_SIZE:
+                manifest.commit()
+                self._manifest_pending = 0
+
+    def _open_manifest(self) -> sqlite3.Connection:
+        # must be called with the manifest lock held
+        if self._manifest is None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            self._manifest = sqlite3.connect(
+                self._manifest_path, check_same_thread=False)
+            self._manifest.execute("PRAGMA journal_mode=WAL")
+            self._manifest.execute("PRAGMA synchronous=NORMAL")
+            self._manifest.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "hashalg TEXT, hash TEXT)")
+        return self._manifest
+
     def _hash_file(self, filepath: str, hashalg: str) -> str:
-        contents = None
+        # stream the file through the hash function rather than reading it
+        # whole, as some distributions weigh hundreds of megabytes
         with open(filepath, "rb") as fh:
-            # verify downloaded file has same hash
-            contents = fh.read()
-
-        truehash = hashlib.new(hashalg)
-        truehash.update(contents)
+            if hasattr(hashlib, "file_digest"):
+                truehash = hashlib.file_digest(fh, hashalg)
+            else:
+                truehash = hashlib.new(hashalg)
+                for chunk in read_chunks(fh):
+                    truehash.update(chunk)
 
-        with open("{}.hash".format(filepath), "w") as out:
-            out.write("{}={}".format(hashalg, truehash.hexdigest()))
+        self._write_hash_file(filepath, hashalg, truehash.hexdigest())
 
         return truehash.hexdigest()
 
+    def _write_hash_file(self, filepath: str, hashalg: str, hexdigest: str):
+        # leave an up-to-date hash file untouched, rather than rewriting it and
+        # changing its modification time (which also makes tools like rsync
+        # copy it again)
+        hashpath = "{}.hash".format(filepath)
+        contents = "{}={}".format(hashalg, hexdigest)
+        try:
+            with open(hashpath, "r") as fh:
+                if fh.read() == contents:
+                    return
+        except FileNotFoundError:
+            pass
+
+        with open(hashpath, "w") as out:
+            out.write(contents)
+
     def _extract_metadata(
         self,
         filepath: str,
@@ -379,37 +703,134 @@ class Mirrorer:
         version: packaging.version.Version,
     ) -> metadata.MetadataParser:
         md = metadata.MetadataParser(filepath)
+        metadata_path = "{}.metadata".format(filepath)
+
+        # wheels and zip source archives only have one source of metadata (the
+        # METADATA and PKG-INFO files, respectively), so the rest of their
+        # members can be skipped once it was read
+        single_source = filepath.endswith((".whl", ".zip"))
+
+        # for those, the copy of the metadata file written on a previous run
+        # holds everything there is to parse, so the archive isn't opened at
+        # all unless it was written (downloaded) after the copy was made
+        if single_source and is_newer(metadata_path, filepath):
+            try:
+                md.parse_metadata_file(metadata_path)
+                return md
+            except Exception as e:
+                log("Failed parsing {}: {}".format(metadata_path, e))
+                md = metadata.MetadataParser(filepath)
 
         archive = None
         members = None
         opener = None
 
-        if re.search(r"\.(whl|zip)$", filepath):
+        # members are opened by their ZipInfo/TarInfo objects rather than by
+        # name, which tarfile would look up by loading and scanning the whole
+        # index of the archive
+        if filepath.endswith((".whl", ".zip")):
             archive = zipfile.ZipFile(filepath)
-            members = [member.filename for member in archive.infolist()]
+            members = ((member.filename, member)
+                       for member in archive.infolist())
             opener = archive.open
-        elif re.search(r"\.tar.gz$", filepath):
-            archive = tarfile.open(filepath)
-            members = [member.name for member in archive.getmembers()]
+        elif filepath.endswith(".tar.gz"):
+            archive = tarfile.open(filepath, mode="r:gz")
+            members = ((member.name, member) for member in archive)
             opener = archive.extractfile
         else:
             raise Exception("Unexpected distribution file {}".format(filepath))
 
-        for member in members:
+        for (name, member) in members:
+            # most members are modules and data files, skip them without
+            # going through the parser's pattern matching
+            if not name.endswith(metadata.METADATA_FILENAMES):
+                continue
             try:
-                md.parse(opener, member)
+                md.parse(lambda _: opener(member), name)
             except Exception as e:
-                print("Failed parsing member {} of {}: {}".format(
-                    member, filepath, e))
+                log("Failed parsing member {} of {}: {}".format(
+                    name, filepath, e))
+            if single_source and md.seen_metadata_file():
+                break
 
         if md.seen_metadata_file():
-            md.write_metadata_file("{}.metadata".format(filepath))
+            md.write_metadata_file(metadata_path)
 
         archive.close()
 
         return md
 
 
+def log(message: str):
+    """
+    Prints a message on a line of its own. Unlike print, which writes the
+    message and the line break separately, the line is written at once, so
+    that lines printed by concurrent tasks don't run into each other.
+    """
+
+    sys.stdout.write("{}\n".format(message))
+
+
+def is_newer(path: str, other: str) -> bool:
+    """
+    Returns True if the file at path exists and was modified no earlier than
+    the file at other.
+    """
+
+    try:
+        return os.stat(path).st_mtime_ns >= os.stat(other).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def write_atomically(path: str, data: bytes):
+    """
+    Writes data to the file at path through a temporary file in the same
+    directory, which then replaces it, so that readers never see (and
+    interruptions never leave) a partially written file.
+    """
+
+    (fd, tmp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def wait_all(futures: Iterable[concurrent.futures.Future]):
+    """
+    Waits for all the provided futures to be done. If waiting is interrupted
+    (e.g. by KeyboardInterrupt), futures that didn't start yet are cancelled,
+    and those that are running are waited for, before the exception propagates.
+    """
+
+    futures = list(futures)
+    try:
+        concurrent.futures.wait(futures)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        raise
+
+
+def read_chunks(fp: BinaryIO) -> Iterator[memoryview]:
+    """
+    Reads a binary file object in chunks of up to CHUNK_SIZE bytes, reusing the
+    same buffer rather than allocating a new bytes object for every chunk. Each
+    chunk is therefore only valid until the next one is read.
+    """
+
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    for size in iter(lambda: fp.readinto(buf), 0):
+        yield view[:size]
+
+
 def parse_interpreter(inp: str) -> Tuple[str, str]:
     """
     Parse interpreter tags in the name of a binary wheel file. Returns a tuple
@@ -417,7 +838,7 @@ def parse_interpreter(inp: str) -> Tuple[str, str]:
     <major>.<minor>.
     """
 
-    m = re.fullmatch(r"^([^\d]+)(?:(\d)(?:[._])?(\d+)?)$", inp)
+    m = interpreter_re.fullmatch(inp)
     if m is None:
         return (inp, None)
 
@@ -431,6 +852,34 @@ def parse_interpreter(inp: str) -> Tuple[str, str]:
     return (intr, version)
 
 
+@functools.lru_cache(maxsize=65536)
+def parse_wheel_filename(filename: str) -> Tuple[
+    packaging.utils.NormalizedName,
+    packaging.version.Version,
+    packaging.utils.BuildTag,
+    FrozenSet[packaging.tags.Tag],
+]:
+    """
+    Memoized version of packaging.utils.parse_wheel_filename. A package's
+    files are parsed again for every distinct requirement on it, and the
+    results are immutable, so they are safe to share.
+    """
+
+    return packaging.utils.parse_wheel_filename(filename)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_sdist_filename(filename: str) -> Tuple[
+    packaging.utils.NormalizedName,
+    packaging.version.Version,
+]:
+    """
+    Memoized version of packaging.utils.parse_sdist_filename.
+    """
+
+    return packaging.utils.parse_sdist_filename(filename)
+
+
 def parse_requirement(req_string: str) -> packaging.requirements.Requirement:
     """
     Parse a requirement string into a packaging.requirements.Requirement object.
@@ -442,33 +891,55 @@ def parse_requirement(req_string: str) -> packaging.requirements.Requirement:
     return req
 
 
-def mirror(index_path: str):
+def mirror(index_path: str, download_workers: int = 8):
     """
     Run the mirror on the package index in the provided path, and based on the
     morgan.ini configuration file in the index. Copies the server script to the
     index at the end of the process. This function can safely be called multiple
-    times on the same index path, files are only downloaded if necessary.
+    times on the same index path, files are only downloaded if necessary. Up to
+    download_workers files are downloaded, and as many packages mirrored,
+    concurrently.
     """
 
-    m = Mirrorer(index_path)
-    for package in m.config["requirements"]:
-        reqs = m.config['requirements'][package].splitlines()
-        if not reqs:
-            # empty requirements
-            # morgan =
-            m.mirror(f'{package}')
-        else:
-            # multiline requirements
-            # urllib3 =
-            #   <1.27
-            #   >=2
-            #   [brotli]
-            for req in reqs:
-                req = req.strip()
-                m.mirror(f'{package}{req}')
+    m = Mirrorer(index_path, download_workers)
+    requirements = m.config["requirements"]
+    try:
+        m.prefetch(requirements)
+        for (package, value) in requirements.items():
+            reqs = value.splitlines()
+            if not reqs:
+                # empty requirements
+                # morgan =
+                m.mirror(f'{package}')
+            else:
+                # multiline requirements
+                # urllib3 =
+                #   <1.27
+                #   >=2
+                #   [brotli]
+                for req in reqs:
+                    req = req.strip()
+                    m.mirror(f'{package}{req}')
+    finally:
+        m.close()
     m.copy_server()
 
 
+def positive_int(value: str) -> int:
+    """
+    Parses a command line argument that must be a positive integer.
+    """
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "must be a positive integer, got {!r}".format(value))
+    return number
+
+
 def main():
     """
     Executes the command line interface of Morgan. Use -h for a full list of
@@ -484,6 +955,14 @@ def main():
         default=os.getcwd(),
         help='Path to the package index')
 
+    parser.add_argument(
+        '--download-workers',
+        dest='download_workers',
+        default=8,
+        type=positive_int,
+        help='Number of files to download, and of packages to mirror, '
+             'concurrently')
+
     server.add_arguments(parser)
     configurator.add_arguments(parser)
 
@@ -502,7 +981,7 @@ def main():
     elif args.command == "generate_reqs":
         configurator.generate_reqs(args.mode)
     elif args.command == "mirror":
-        mirror(args.index_path)
+        mirror(args.index_path, args.download_workers)
     elif args.command == "copy_server":
         Mirrorer(args.index_path).copy_server()
     elif args.command == "version":
@@ -1,9 +1,8 @@
 import argparse
-from collections import OrderedDict
-import configparser
 import os
 import platform
 import sys
+from typing import Dict
 
 from packaging.version import Version
 
@@ -21,8 +20,7 @@ def generate_env(name: str = "local"):
     the configuration file, or piped to it using shell redirection (e.g. `>>`).
     """
 
-    config = configparser.ConfigParser()
-    config["env.{}".format(name)] = {
+    write_section("env.{}".format(name), {
         'os_name': os.name,
         'sys_platform': sys.platform,
         'platform_machine': platform.machine(),
@@ -31,8 +29,7 @@ def generate_env(name: str = "local"):
         'python_version': '.'.join(platform.python_version_tuple()[:2]),
         'python_full_version': platform.python_version(),
         'implementation_name': sys.implementation.name,
-    }
-    config.write(sys.stdout)
+    })
 
 
 def generate_reqs(mode: str = ">="):
@@ -49,11 +46,30 @@ def generate_reqs(mode: str = ">="):
             ">=" for minimum versioning, or "<=" for maximum versioning.
             Defaults to ">=".
     """
-    requirements = {dist.metadata["Name"].lower(): f"{mode}{dist.version}"
-                    for dist in metadata.distributions()}
-    config = configparser.ConfigParser()
-    config["requirements"] = OrderedDict(sorted(requirements.items()))
-    config.write(sys.stdout)
+    # every access to dist.metadata (which dist.version also goes through)
+    # reads and parses the distribution's metadata file again, so it's only
+    # accessed once per distribution
+    requirements = {}
+    for dist in metadata.distributions():
+        dist_metadata = dist.metadata
+        if dist_metadata["Name"]:
+            requirements[dist_metadata["Name"].lower()] = \
+                f"{mode}{dist_metadata['Version']}"
+    write_section("requirements", dict(sorted(requirements.items())))
+
+
+def write_section(name: str, values: Dict[str, str]):
+    """
+    Write a configuration block to standard output, in the same format
+    configparser uses, without going through a ConfigParser object. Values must
+    be single-line strings, and keys must already be lowercase.
+    """
+
+    lines = ["[{}]\n".format(name)]
+    lines.extend("{} = {}\n".format(key, value)
+                 for (key, value) in values.items())
+    lines.append("\n")
+    sys.stdout.write("".join(lines))
 
 
 def add_arguments(parser: argparse.ArgumentParser):
@@ -0,0 +1,134 @@
+import contextlib
+import http.client
+import io
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, Iterator
+
+from morgan.__about__ import __version__
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3
+TIMEOUT = 30
+RETRY_ERRORS = (http.client.HTTPException, ConnectionError, socket.timeout)
+USER_AGENT = "morgan/{}".format(__version__)
+
+
+class ConnectionPool:
+    """
+    ConnectionPool keeps persistent HTTP(S) connections to the hosts Morgan
+    downloads from, so that consecutive requests to the same host (which is the
+    common case when mirroring from PyPI) reuse the same TCP connection and TLS
+    session rather than establishing a new one per request. Connections are
+    kept per thread, as they cannot be shared by concurrent requests.
+
+    Requests that fail due to connection errors, or that get no response for
+    TIMEOUT seconds, are retried up to MAX_RETRIES times, with exponential
+    backoff. Requests to hosts that are configured to go through a proxy (via
+    the usual environment variables) are delegated to urllib, which handles
+    proxies.
+
+    Errors are reported the same way urllib reports them, i.e. by raising
+    urllib.error.HTTPError for responses with 3xx (other than redirects), 4xx
+    and 5xx status codes.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._proxies = urllib.request.getproxies()
+
+    @contextlib.contextmanager
+    def open(
+        self,
+        url: str,
+        headers: Dict[str, str] = None,
+    ) -> Iterator[http.client.HTTPResponse]:
+        """
+        Sends a GET request to the provided URL, and yields the response. The
+        response body should be read completely inside the context for the
+        connection to be reused, otherwise it is closed.
+        """
+
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", USER_AGENT)
+
+        if self._uses_proxy(url):
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                yield response
+            return
+
+        for _ in range(MAX_REDIRECTS + 1):
+            (conn, response) = self._request(url, headers)
+            if 200 <= response.status < 300:
+                break
+
+            # read the body so the connection can be reused
+            body = response.read()
+            if response.status in REDIRECT_CODES and \
+                    response.headers.get("Location"):
+                url = urllib.parse.urljoin(url, response.headers["Location"])
+                continue
+
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers,
+                io.BytesIO(body))
+        else:
+            raise urllib.error.HTTPError(
+                url, response.status, "Too many redirects", response.headers,
+                None)
+
+        try:
+            yield response
+        finally:
+            if not response.isclosed():
+                # the body wasn't consumed, the connection can't be reused
+                conn.close()
+
+    def _request(self, url: str, headers: Dict[str, str]):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        key = (parts.scheme, parts.netloc)
+        for attempt in range(MAX_RETRIES + 1):
+            conn = connections.get(key)
+            reused = conn is not None
+            if not reused:
+                if parts.scheme == "https":
+                    conn = http.client.HTTPSConnection(
+                        parts.netloc, timeout=TIMEOUT)
+                else:
+                    conn = http.client.HTTPConnection(
+                        parts.netloc, timeout=TIMEOUT)
+                connections[key] = conn
+
+            try:
+                conn.request("GET", path, headers=headers)
+                return (conn, conn.getresponse())
+            except RETRY_ERRORS:
+                conn.close()
+                del connections[key]
+                if attempt == MAX_RETRIES:
+                    raise
+                # a reused connection was most likely closed by the server
+                # while idle, so it's retried on a new one right away
+                if not reused:
+                    time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    def _uses_proxy(self, url: str) -> bool:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in self._proxies:
+            return False
+        return not urllib.request.proxy_bypass(parts.hostname or "")
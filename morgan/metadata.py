@@ -1,6 +1,8 @@
+import copy
 import email.parser
+import functools
 import re
-from typing import Dict, Set, Callable, BinaryIO, Iterable
+from typing import Dict, Set, Callable, BinaryIO, Iterable, FrozenSet, Tuple
 
 from packaging.version import Version
 from packaging.requirements import Requirement
@@ -14,6 +16,34 @@ METADATA_VERSION_11 = Version("1.1")
 METADATA_VERSION_12 = Version("1.2")
 METADATA_VERSION_21 = Version("2.1")
 
+wheel_metadata_re = re.compile(r"[^/]+\.dist-info/METADATA")
+zip_pkginfo_re = re.compile(r"([^/]+/)?PKG-INFO")
+sdist_pkginfo_re = re.compile(r"[^/]+/PKG-INFO")
+requirestxt_re = re.compile(
+    r"[^/]+(/[^/]+)?\.egg-info/(setup_)?requires\.txt")
+pyproject_re = re.compile(r"[^/]+/pyproject\.toml")
+
+# suffixes of all the file names that MetadataParser.parse may gather metadata
+# from, any other file is irrelevant
+METADATA_FILENAMES = ("METADATA", "PKG-INFO", "requires.txt", "pyproject.toml")
+
+
+def cached_requirement(requirement_str: str) -> Requirement:
+    """
+    Parses a requirement string into a packaging.requirements.Requirement
+    object. Parsing is memoized, as the same requirement strings recur in the
+    metadata of every file of a release, and across packages. A shallow copy of
+    the memoized object is returned, so callers are free to modify it. Unlike
+    morgan.parse_requirement, the name of the package is not canonicalized.
+    """
+
+    return copy.copy(_cached_requirement(requirement_str))
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_requirement(requirement_str: str) -> Requirement:
+    return Requirement(requirement_str)
+
 
 class MetadataParser:
     """
@@ -99,21 +129,22 @@ class MetadataParser:
         parse_func = None
         main_metadata_file = False
 
-        if re.search(r"\.whl$", self.source_path):
-            if re.fullmatch(r"[^/]+\.dist-info/METADATA", filename):
+        if self.source_path.endswith(".whl"):
+            if wheel_metadata_re.fullmatch(filename):
                 parse_func = self._parse_metadata_file
                 main_metadata_file = True
-        elif re.search(r"\.zip$", self.source_path):
-            if re.fullmatch(r"([^/]+/)?PKG-INFO", filename):
+        elif self.source_path.endswith(".zip"):
+            if zip_pkginfo_re.fullmatch(filename):
                 parse_func = self._parse_metadata_file
                 main_metadata_file = True
-        elif re.search(r"\.tar\.gz$", self.source_path):
-            if re.fullmatch(r"[^/]+/PKG-INFO", filename):
+        elif self.source_path.endswith(".tar.gz"):
+            if sdist_pkginfo_re.fullmatch(filename):
                 parse_func = self._parse_metadata_file
                 main_metadata_file = True
-            elif re.fullmatch(r"[^/]+(/[^/]+)?\.egg-info/(setup_)?requires.txt", filename):
-                parse_func = self._parse_requirestxt
-            elif re.fullmatch(r"[^/]+/pyproject.toml", filename):
+            elif requirestxt_re.fullmatch(filename):
+                parse_func = functools.partial(
+                    self._parse_requirestxt, filename=filename)
+            elif pyproject_re.fullmatch(filename):
                 parse_func = self._parse_pyproject
 
         if parse_func:
@@ -123,6 +154,23 @@ class MetadataParser:
                     fp.seek(0)
                 parse_func(fp)
 
+    def parse_metadata_file(self, filename: str):
+        """
+        Parses a standalone copy of the archive's main METADATA file, such as
+        one previously written by write_metadata_file, instead of the file
+        inside the archive. Raises a ValueError if the copy doesn't hold the
+        metadata version, name and version of the package, e.g. because it
+        is damaged.
+        """
+
+        with open(filename, "rb") as fp:
+            self._metadata_file = fp.read()
+            fp.seek(0)
+            self._parse_metadata_file(fp)
+
+        if self.name is None or self.version is None:
+            raise ValueError("Invalid metadata file", filename)
+
     def seen_metadata_file(self) -> bool:
         """
         Returns a boolean value if the archive's main METADATA file has already
@@ -146,7 +194,8 @@ class MetadataParser:
     def dependencies(
         self,
         extras: Set[str] = set(),
-        envs: Iterable[Dict] = []
+        envs: Iterable[Dict] = [],
+        marker_cache: Dict[Tuple[str, FrozenSet[str]], bool] = None,
     ) -> Set[Requirement]:
         """
         Resolves the dependencies of the package, returning a set of
@@ -164,12 +213,21 @@ class MetadataParser:
             The list of environments for which Morgan is downloading package
             distributions. These are simple dictionaries whose keys match those
             defined by the "Environment Markers" section of PEP 508.
+        marker_cache: Dict[Tuple[str, FrozenSet[str]], bool] = None
+            An optional dictionary in which the relevance of environment
+            markers is memoized, keyed by the marker string and the set of
+            extras. It can be shared between calls (and instances), so long
+            as they are provided with the same environments.
 
         Returns
         -------
         A set of packaging.requirements.Requirement objects.
         """
 
+        # the extras are set once, on copies of the environments, rather than
+        # on the caller's environments before every marker evaluation
+        envs = [{**env, "extra": ",".join(extras)} for env in envs]
+
         deps = set()
         deps |= self.core_dependencies
         deps |= self.build_dependencies
@@ -190,33 +248,37 @@ class MetadataParser:
             elif extra in extras:
                 deps |= self.optional_dependencies[extra]
 
-        irrelevant_deps = set()
-        for dep in deps:
-            relevant = True
-            if dep.marker:
-                relevant = False
-                for env in envs:
-                    env["extra"] = ",".join(extras)
-                    if dep.marker.evaluate(env):
-                        relevant = True
-                        break
-
-            if not relevant:
-                irrelevant_deps.add(dep)
-                continue
-
-        deps -= irrelevant_deps
-
-        return deps
+        # most dependencies have no markers and are always relevant, only the
+        # rest go through marker evaluation
+        relevant_deps = {dep for dep in deps if not dep.marker}
+        relevant_deps |= {
+            dep for dep in deps
+            if dep.marker and
+            self._marker_relevant(dep.marker, extras, envs, marker_cache)}
+
+        return relevant_deps
+
+    def _marker_relevant(self, marker, extras, envs, marker_cache):
+        key = (str(marker), frozenset(extras))
+        relevant = marker_cache.get(key) if marker_cache is not None else None
+        if relevant is None:
+            relevant = any(marker.evaluate(env) for env in envs)
+            if marker_cache is not None:
+                marker_cache[key] = relevant
+        return relevant
 
     def _add_core_requirements(self, reqs):
-        self.core_dependencies |= set([Requirement(dep) for dep in reqs])
+        self.core_dependencies |= set([cached_requirement(dep) for dep in reqs])
 
     def _add_optional_requirements(self, extra, reqs):
         if extra not in self.optional_dependencies:
             self.optional_dependencies[extra] = set()
         self.optional_dependencies[extra] |= set(
-            [Requirement(dep) for dep in reqs])
+            [cached_requirement(dep) for dep in reqs])
+
+    def _add_build_requirements(self, reqs):
+        self.build_dependencies |= set(
+            [cached_requirement(dep) for dep in reqs])
 
     def _parse_pyproject(self, fp):
         data = tomli.load(fp)
@@ -245,8 +307,7 @@ class MetadataParser:
 
         build_system = data.get("build-system")
         if build_system is not None and "requires" in build_system:
-            self.build_dependencies |= set(
-                [Requirement(req) for req in build_system["requires"]])
+            self._add_build_requirements(build_system["requires"])
 
     def _parse_metadata_file(self, fp):
         data = email.parser.BytesParser().parse(fp, True)
@@ -284,7 +345,7 @@ class MetadataParser:
         requires_dist = data.get_all("Requires-Dist")
         if requires_dist is not None:
             for requirement_str in requires_dist:
-                req = Requirement(requirement_str)
+                req = cached_requirement(requirement_str)
                 extra = None
                 if req.marker is not None:
                     for marker in req.marker._markers:
@@ -304,9 +365,9 @@ class MetadataParser:
         requires = data.get_all("Requires")
         if requires is not None:
             for requirement_str in requires:
-                self.core_dependencies.add(Requirement(requirement_str))
+                self.core_dependencies.add(cached_requirement(requirement_str))
 
-    def _parse_requirestxt(self, fp):
+    def _parse_requirestxt(self, fp, filename):
         section = None
         content = []
         for line in fp.readlines():
@@ -314,12 +375,8 @@ class MetadataParser:
             if line.startswith("["):
                 if line.endswith("]"):
                     if section or content:
-                        if section:
-                            self._add_optional_requirements(section, content)
-                        elif fp.name.endswith("setup_requires.txt"):
-                            self._add_build_requirements(content)
-                        else:
-                            self._add_core_requirements(content)
+                        self._add_requirestxt_section(
+                            filename, section, content)
                     section = line[1:-1]
                     content = []
                 else:
@@ -327,9 +384,14 @@ class MetadataParser:
             elif line:
                 content.append(line)
 
+        self._add_requirestxt_section(filename, section, content)
+
+    def _add_requirestxt_section(self, filename, section, reqs):
+        # the file object's name is that of the archive, so the member's name
+        # is needed to tell setup_requires.txt apart from requires.txt
         if section:
-            self._add_optional_requirements(section, content)
-        elif fp.name.endswith("setup_requires.txt"):
-            self._add_build_requirements(content)
+            self._add_optional_requirements(section, reqs)
+        elif filename.endswith("setup_requires.txt"):
+            self._add_build_requirements(reqs)
         else:
-            self._add_core_requirements(content)
+            self._add_core_requirements(reqs)
@@ -69,7 +69,9 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         projects = []
         with os.scandir(index_path) as it:
             for entry in it:
-                if entry.is_dir():
+                # hidden directories (e.g. the mirrorer's cache) aren't
+                # projects
+                if entry.is_dir() and not entry.name.startswith("."):
                     projects.append({"name": entry.name})
         projects.sort(key=lambda proj: proj["name"])
 
@@ -109,7 +111,7 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         files = []
         with os.scandir(path) as it:
             for entry in it:
-                if re.search(r"\.(whl|zip|tar\.gz)$", entry.name):
+                if entry.name.endswith((".whl", ".zip", ".tar.gz")):
                     file = {
                         "filename": entry.name,
                         "url": "/{}/{}".format(project, entry.name),
@@ -183,14 +185,14 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             self._serve_notfound("No such project {}".format(project))
             return
 
-        if no_metadata and re.search(r"\.metadata$", filename):
+        if no_metadata and filename.endswith(".metadata"):
             self._serve_notfound("No such file {}".format(filename))
             return
 
         ct = "text/plain"
-        if re.search(r"\.(whl|zip)$", filename):
+        if filename.endswith((".whl", ".zip")):
             ct = "application/octet-stream"
-        elif re.search(r"\.tar\.gz$", filename):
+        elif filename.endswith(".tar.gz"):
             ct = "application/x-tar"
 
         self.send_response(200)
@@ -256,7 +258,10 @@ def parse_accept_header(header_val: str) -> str:
     return None
 
 
-opt_re = re.compile(r"([^;]+)\s*(?:;.*q=(\d(?:\.\d+)?))")
+# matched against the parameters of an option only. Splitting the MIME type off
+# first keeps matching linear, whereas a single pattern for the whole option
+# backtracks quadratically on long options without a quality parameter.
+quality_re = re.compile(r".*q=(\d(?:\.\d+)?)")
 
 
 def parse_accept_option(option: str) -> dict:
@@ -266,13 +271,14 @@ def parse_accept_option(option: str) -> dict:
     float). If option does not specifically list a priority, it will be zero.
     """
 
-    m = opt_re.match(option)
+    (mime, sep, params) = option.partition(";")
+    m = quality_re.match(params) if sep and mime else None
     if m is None:
         return {"mime": option.strip(), "priority": 0}
 
     return {
-        "mime": m.group(1).strip(),
-        "priority": float(m.group(2)) if m.lastindex == 2 else 0
+        "mime": mime.strip(),
+        "priority": float(m.group(1)),
     }
 
 
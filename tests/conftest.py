@@ -0,0 +1,69 @@
+import http.server
+import os
+import threading
+
+import pytest
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Handler serves the routes of the test server. Routes map request paths to
+    functions that are called with the handler to send the response, paths
+    without a route get a 404 response. The server counts the connections it
+    accepted, and records the path and headers of every request.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # the client dropped a connection it didn't read completely
+            pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        route = self.server.routes.get(self.path)
+        if route is None:
+            self.send_body(b"not found", 404)
+        else:
+            route(self)
+
+    def send_body(self, body, code=200, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        for (header, value) in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(http.server.ThreadingHTTPServer):
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server_port, path)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for key in list(os.environ):
+        if key.lower().endswith("_proxy"):
+            monkeypatch.delenv(key)
+
+    httpd = Server(("127.0.0.1", 0), Handler)
+    httpd.routes = {}
+    httpd.requests = []
+    httpd.connections = 0
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
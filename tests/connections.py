@@ -0,0 +1,86 @@
+import urllib.error
+
+import pytest
+
+from morgan import connections
+
+
+def redirect(handler):
+    handler.send_body(b"", 302, {"Location": "/ok"})
+
+
+def not_modified(handler):
+    handler.send_response(304)
+    handler.end_headers()
+
+
+def close(handler):
+    # closes the connection without telling the client, like servers
+    # dropping idle connections do
+    handler.send_body(b"closed")
+    handler.close_connection = True
+
+
+ROUTES = {
+    "/redirect": redirect,
+    "/not-modified": not_modified,
+    "/ok": lambda handler: handler.send_body(b"ok"),
+    "/close": close,
+    "/large": lambda handler: handler.send_body(b"x" * (1 << 20)),
+}
+
+
+@pytest.fixture
+def server(server):
+    server.routes.update(ROUTES)
+    return server
+
+
+def test_reuses_connection(server):
+    pool = connections.ConnectionPool()
+    for _ in range(3):
+        with pool.open(server.url("/ok")) as response:
+            assert response.read() == b"ok"
+    assert server.connections == 1
+
+
+def test_follows_redirect(server):
+    pool = connections.ConnectionPool()
+    with pool.open(server.url("/redirect")) as response:
+        assert response.status == 200
+        assert response.read() == b"ok"
+
+
+@pytest.mark.parametrize("path, code", [("/missing", 404),
+                                        ("/not-modified", 304)])
+def test_raises_http_error(server, path, code):
+    pool = connections.ConnectionPool()
+    with pytest.raises(urllib.error.HTTPError) as err:
+        with pool.open(server.url(path)):
+            pass
+    assert err.value.code == code
+
+    # the connection is still usable after an error response
+    with pool.open(server.url("/ok")) as response:
+        assert response.read() == b"ok"
+    assert server.connections == 1
+
+
+def test_retries_connection_closed_by_server(server):
+    pool = connections.ConnectionPool()
+    with pool.open(server.url("/close")) as response:
+        assert response.read() == b"closed"
+    with pool.open(server.url("/ok")) as response:
+        assert response.read() == b"ok"
+    assert server.connections == 2
+
+
+def test_closes_partly_read_connection(server):
+    pool = connections.ConnectionPool()
+    with pool.open(server.url("/large")) as response:
+        response.read(1024)
+    assert response.isclosed()
+
+    with pool.open(server.url("/ok")) as response:
+        assert response.read() == b"ok"
+    assert server.connections == 2
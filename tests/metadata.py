@@ -0,0 +1,48 @@
+import io
+
+from morgan import metadata
+
+
+def parse_files(source_path, files):
+    md = metadata.MetadataParser(source_path)
+    for filename in files:
+        md.parse(lambda name: io.BytesIO(files[name]), filename)
+    return md
+
+
+def names(reqs):
+    return {req.name for req in reqs}
+
+
+def test_parse_requirestxt():
+    md = parse_files("pkg-1.0.tar.gz", {
+        "pkg-1.0/pkg.egg-info/requires.txt": b"alpha\n\n[x]\nbeta\n",
+        "pkg-1.0/pkg.egg-info/setup_requires.txt": b"theta\n",
+    })
+
+    assert names(md.core_dependencies) == {"alpha"}
+    assert names(md.build_dependencies) == {"theta"}
+    assert names(md.optional_dependencies["x"]) == {"beta"}
+
+
+def test_dependencies_dont_leak_extras():
+    md = parse_files("pkg-1.0.tar.gz", {
+        "pkg-1.0/pkg.egg-info/requires.txt": (
+            b"alpha\n\n"
+            b"[x]\nbeta; python_version >= '3'\n\n"
+            b"[:extra == 'x']\ngamma\n"
+        ),
+    })
+    envs = [{
+        "python_version": "3.9",
+        "sys_platform": "linux",
+        "platform_release": "",
+        "platform_version": "",
+        "implementation_version": "",
+        "extra": "",
+    }]
+    orig_envs = [dict(env) for env in envs]
+
+    assert "beta" in names(md.dependencies({"x"}, envs))
+    assert names(md.dependencies(set(), envs)) == {"alpha"}
+    assert envs == orig_envs
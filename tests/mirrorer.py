@@ -0,0 +1,378 @@
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+import urllib.error
+import zipfile
+
+import pytest
+
+import packaging.version
+
+import morgan
+
+ENV = """
+[env.test]
+os_name = posix
+sys_platform = linux
+platform_machine = x86_64
+platform_python_implementation = CPython
+platform_system = Linux
+python_version = 3.10
+python_full_version = 3.10.6
+implementation_name = cpython
+"""
+
+
+def serve(route):
+    """
+    Returns a route of the test server that sends route["body"] with the
+    status route["code"] (200 by default), after route["delay"] seconds. If
+    route["etag"] is set, it is sent along, and requests that provide it in
+    If-None-Match get a 304 response.
+    """
+
+    def respond(handler):
+        time.sleep(route.get("delay", 0))
+        etag = route.get("etag")
+        if etag and handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.end_headers()
+        else:
+            handler.send_body(route["body"], route.get("code", 200),
+                              {"ETag": etag} if etag else None)
+
+    return respond
+
+
+@pytest.fixture
+def server(server, monkeypatch):
+    monkeypatch.setattr(morgan, "PYPI_ADDRESS", server.url("/simple/"))
+    return server
+
+
+def wheel(name, requires=()):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr(
+            "{}-1.0.dist-info/METADATA".format(name),
+            "Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n{}".format(
+                name,
+                "".join("Requires-Dist: {}\n".format(req)
+                        for req in requires)))
+    return buf.getvalue()
+
+
+def sdist(name, requires=()):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as archive:
+        for (member, content) in [
+            ("{}-1.0/PKG-INFO".format(name),
+             "Metadata-Version: 1.1\nName: {}\nVersion: 1.0\n".format(name)),
+            ("{0}-1.0/{0}.egg-info/requires.txt".format(name),
+             "".join("{}\n".format(req) for req in requires)),
+        ]:
+            data = content.encode("UTF-8")
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def file_info(server, filename, body, **route):
+    path = "/files/{}".format(filename)
+    server.routes[path] = serve({"body": body, **route})
+    return {
+        "filename": filename,
+        "url": server.url(path),
+        "hashes": {"sha256": hashlib.sha256(body).hexdigest()},
+    }
+
+
+def add_project(server, name, files=None, **route):
+    entries = [
+        file_info(server, filename, body, **file_route)
+        for (filename, body, file_route) in files or ()
+    ]
+    route = {
+        "body": json.dumps({
+            "meta": {"api-version": "1.0"},
+            "name": name,
+            "files": entries,
+        }).encode("UTF-8"),
+        **route,
+    }
+    server.routes["/simple/{}/".format(name)] = serve(route)
+    return route
+
+
+def project_requests(server, name):
+    return [headers for (path, headers) in server.requests
+            if path == "/simple/{}/".format(name)]
+
+
+def test_fetch_project(server, tmp_path):
+    add_project(server, "pkg", etag='"v1"')
+
+    m = morgan.Mirrorer(str(tmp_path))
+    assert m._fetch_project("pkg")["name"] == "pkg"
+    # the response is kept for the rest of the run
+    assert m._fetch_project("pkg")["name"] == "pkg"
+
+    requests = project_requests(server, "pkg")
+    assert len(requests) == 1
+    assert "If-None-Match" not in requests[0]
+
+    cache_dir = tmp_path / ".morgan-cache"
+    with gzip.open(str(cache_dir / "pkg.json.gz")) as fh:
+        assert json.load(fh)["name"] == "pkg"
+    assert json.loads((cache_dir / "pkg.headers").read_text()) == \
+        {"ETag": '"v1"'}
+    # nothing is left behind by the atomic replacement of the files
+    assert sorted(os.listdir(str(cache_dir))) == ["pkg.headers", "pkg.json.gz"]
+
+
+def test_fetch_project_reuses_unmodified_response(server, tmp_path):
+    route = add_project(server, "pkg", etag='"v1"')
+    morgan.Mirrorer(str(tmp_path))._fetch_project("pkg")
+
+    # the server would return a different body if the stored one was not
+    # reused
+    route["body"] = b"invalid"
+    data = morgan.Mirrorer(str(tmp_path))._fetch_project("pkg")
+    assert data["name"] == "pkg"
+
+    requests = project_requests(server, "pkg")
+    assert len(requests) == 2
+    assert requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_fetch_project_refetches_damaged_response(server, tmp_path):
+    add_project(server, "pkg", etag='"v1"')
+    morgan.Mirrorer(str(tmp_path))._fetch_project("pkg")
+
+    cache_path = tmp_path / ".morgan-cache" / "pkg.json.gz"
+    cache_path.write_bytes(b"damaged")
+    data = morgan.Mirrorer(str(tmp_path))._fetch_project("pkg")
+    assert data["name"] == "pkg"
+
+    # the conditional request is followed by a single unconditional one
+    requests = project_requests(server, "pkg")
+    assert len(requests) == 3
+    assert requests[1]["If-None-Match"] == '"v1"'
+    assert "If-None-Match" not in requests[2]
+
+    # the stored response was repaired
+    with gzip.open(str(cache_path)) as fh:
+        assert json.load(fh)["name"] == "pkg"
+
+
+def file_requests(server, fileinfo):
+    return [path for (path, _) in server.requests
+            if server.url(path) == fileinfo["url"]]
+
+
+def download(index_path, fileinfo, monkeypatch):
+    """
+    Downloads a file into the index with a new Mirrorer, like a new run of
+    the mirror would, and returns the number of times it was hashed.
+    """
+
+    m = morgan.Mirrorer(index_path)
+    hashed = []
+    hash_file = m._hash_file
+
+    def counting_hash_file(filepath, hashalg):
+        hashed.append(filepath)
+        return hash_file(filepath, hashalg)
+
+    monkeypatch.setattr(m, "_hash_file", counting_hash_file)
+    target = os.path.join(index_path, "pkg", fileinfo["filename"])
+    m._download_file(fileinfo, target, "sha256")
+    m.close()
+    return len(hashed)
+
+
+@pytest.fixture
+def downloaded(server, tmp_path, monkeypatch):
+    fileinfo = file_info(server, "pkg-1.0-py3-none-any.whl", wheel("pkg"))
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 0
+    assert len(file_requests(server, fileinfo)) == 1
+    return (fileinfo, tmp_path / "pkg" / fileinfo["filename"])
+
+
+def test_unchanged_file_is_trusted(server, tmp_path, monkeypatch, downloaded):
+    (fileinfo, path) = downloaded
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 0
+    assert len(file_requests(server, fileinfo)) == 1
+
+
+def test_changed_file_is_hashed(server, tmp_path, monkeypatch, downloaded):
+    (fileinfo, path) = downloaded
+    content = path.read_bytes()
+
+    # touched, but with the same content
+    st = path.stat()
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 1
+    assert len(file_requests(server, fileinfo)) == 1
+    # the new modification time was recorded
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 0
+
+    # damaged, with a different size
+    path.write_bytes(b"damaged")
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 1
+    assert len(file_requests(server, fileinfo)) == 2
+    assert path.read_bytes() == content
+
+
+def test_missing_hash_file_is_hashed(server, tmp_path, monkeypatch,
+                                     downloaded):
+    (fileinfo, path) = downloaded
+    hash_path = path.parent / "{}.hash".format(path.name)
+    hash_path.unlink()
+    assert download(str(tmp_path), fileinfo, monkeypatch) == 1
+    assert len(file_requests(server, fileinfo)) == 1
+    assert hash_path.read_text() == "sha256={}".format(
+        fileinfo["hashes"]["sha256"])
+
+
+def extract(path):
+    m = morgan.Mirrorer(str(path.parent))
+    md = m._extract_metadata(
+        str(path), "pkg", packaging.version.Version("1.0"))
+    return {str(req) for req in md.dependencies()}
+
+
+def count_opens(monkeypatch, module, name):
+    opened = []
+    open_archive = getattr(module, name)
+
+    def counting_open(*args, **kwargs):
+        opened.append(args)
+        return open_archive(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, counting_open)
+    return opened
+
+
+def test_metadata_copy_spares_opening_wheel(tmp_path, monkeypatch):
+    path = tmp_path / "pkg-1.0-py3-none-any.whl"
+    path.write_bytes(wheel("pkg", ["a", "b>=1"]))
+    assert extract(path) == {"a", "b>=1"}
+    assert (tmp_path / "pkg-1.0-py3-none-any.whl.metadata").exists()
+
+    opened = count_opens(monkeypatch, zipfile, "ZipFile")
+    assert extract(path) == {"a", "b>=1"}
+    assert opened == []
+
+
+def test_newer_wheel_is_parsed_again(tmp_path, monkeypatch):
+    path = tmp_path / "pkg-1.0-py3-none-any.whl"
+    path.write_bytes(wheel("pkg", ["a"]))
+    extract(path)
+
+    # downloaded again, after the copy was written
+    path.write_bytes(wheel("pkg", ["c"]))
+    st = (tmp_path / "pkg-1.0-py3-none-any.whl.metadata").stat()
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    opened = count_opens(monkeypatch, zipfile, "ZipFile")
+    assert extract(path) == {"c"}
+    assert len(opened) == 1
+
+
+def test_damaged_metadata_copy_falls_back_to_wheel(tmp_path, monkeypatch):
+    path = tmp_path / "pkg-1.0-py3-none-any.whl"
+    path.write_bytes(wheel("pkg", ["a"]))
+    extract(path)
+
+    metadata_path = tmp_path / "pkg-1.0-py3-none-any.whl.metadata"
+    metadata_path.write_bytes(b"")
+
+    opened = count_opens(monkeypatch, zipfile, "ZipFile")
+    assert extract(path) == {"a"}
+    assert len(opened) == 1
+    # the copy was repaired
+    assert b"Requires-Dist: a" in metadata_path.read_bytes()
+
+
+def test_sdist_is_always_parsed(tmp_path, monkeypatch):
+    path = tmp_path / "pkg-1.0.tar.gz"
+    path.write_bytes(sdist("pkg", ["a"]))
+    assert extract(path) == {"a"}
+    assert (tmp_path / "pkg-1.0.tar.gz.metadata").exists()
+
+    # the copy of PKG-INFO doesn't hold the requirements in requires.txt
+    opened = count_opens(monkeypatch, tarfile, "open")
+    assert extract(path) == {"a"}
+    assert len(opened) == 1
+
+
+def test_failing_dependency_waits_for_siblings(server, tmp_path):
+    (tmp_path / "morgan.ini").write_text(ENV)
+    add_project(server, "root", [
+        ("root-1.0-py3-none-any.whl", wheel("root", ["a", "bad"]), {}),
+    ])
+    add_project(server, "a", [
+        ("a-1.0-py3-none-any.whl", wheel("a"), {"delay": 0.3}),
+    ])
+    add_project(server, "bad", code=500, body=b"error")
+
+    m = morgan.Mirrorer(str(tmp_path))
+    with pytest.raises(urllib.error.HTTPError):
+        m.mirror("root")
+    m.close()
+
+    # the sibling of the failed dependency was mirrored completely, and
+    # recorded in the manifest, before the error was raised
+    conn = sqlite3.connect(str(tmp_path / ".morgan-cache" / "manifest.sqlite"))
+    paths = {path for (path,) in conn.execute("SELECT path FROM files")}
+    conn.close()
+    assert os.path.join("a", "a-1.0-py3-none-any.whl") in paths
+
+
+def test_mirror_shuts_down_its_threads(server, tmp_path):
+    (tmp_path / "morgan.ini").write_text(ENV + "[requirements]\nroot =\n")
+    add_project(server, "root", [
+        ("root-1.0-py3-none-any.whl", wheel("root", ["a"]), {}),
+    ])
+    add_project(server, "a", [("a-1.0-py3-none-any.whl", wheel("a"), {})])
+
+    before = set(threading.enumerate())
+    for _ in range(3):
+        morgan.mirror(str(tmp_path))
+    leaked = [thread for thread in threading.enumerate()
+              if thread not in before and
+              thread.name.startswith("ThreadPoolExecutor")]
+    assert leaked == []
+
+
+def test_wait_all_cancels_pending_tasks_when_interrupted(monkeypatch):
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    started = threading.Event()
+    running = pool.submit(lambda: (started.set(), time.sleep(0.2)))
+    pending = pool.submit(lambda: None)
+    started.wait()
+
+    wait = concurrent.futures.wait
+    calls = []
+
+    def interrupted_wait(futures):
+        calls.append(futures)
+        if len(calls) == 1:
+            raise KeyboardInterrupt()
+        return wait(futures)
+
+    monkeypatch.setattr(concurrent.futures, "wait", interrupted_wait)
+    with pytest.raises(KeyboardInterrupt):
+        morgan.wait_all([running, pending])
+    assert pending.cancelled()
+    assert running.done()
+    pool.shutdown()
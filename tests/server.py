@@ -30,6 +30,15 @@ from morgan import server
             "{};charset=UTF-8&q=0.9".format(server.GENL_HTML_TYPE),
             {"mime": server.GENL_HTML_TYPE, "priority": 0.9}
         ),
+        (
+            "{};charset=UTF-8".format(server.GENL_HTML_TYPE),
+            {"mime": "{};charset=UTF-8".format(server.GENL_HTML_TYPE),
+             "priority": 0}
+        ),
+        (
+            ";q=0.9",
+            {"mime": ";q=0.9", "priority": 0}
+        ),
     ],
 )
 def test_parse_accept_option(accept_option, exp_dict):